@@ -0,0 +1,55 @@
+import hashlib
+import sqlite3
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Tuple
+
+# Stay below SQLite's default limit on bound parameters per statement
+_MAX_QUERY_KEYS = 900
+
+class EmbeddingCache:
+    def __init__(self, db_path: str = "data/embeddings/cache.db"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, model TEXT, vec BLOB)"
+        )
+        self.conn.commit()
+    
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """Build the content-addressed cache key for a text embedded with a model."""
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Look up cached embeddings, returning only the keys that were found."""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        
+        for i in range(0, len(unique_keys), _MAX_QUERY_KEYS):
+            batch = unique_keys[i:i + _MAX_QUERY_KEYS]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT key, vec FROM cache WHERE key IN ({placeholders})", batch
+            )
+            for key, vec in rows:
+                found[key] = np.frombuffer(vec, dtype=np.float32).tolist()
+        
+        return found
+    
+    def put_many(self, model: str, items: List[Tuple[str, List[float]]]):
+        """Store (key, embedding) pairs in a single transaction."""
+        rows = [
+            (key, model, np.asarray(embedding, dtype=np.float32).tobytes())
+            for key, embedding in items
+        ]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, model, vec) VALUES (?, ?, ?)", rows
+            )
+    
+    def close(self):
+        """Close the underlying database connection."""
+        self.conn.close()
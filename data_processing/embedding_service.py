@@ -1,17 +1,56 @@
 import openai
-import json
+import asyncio
+import atexit
+import httpx
+import orjson
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Hashable, Optional
 import os
 from dotenv import load_dotenv
 
+from data_processing.embedding_cache import EmbeddingCache
+from data_processing.text_chunker import _get_encoding
+
 load_dotenv()
 
+# OpenAI embeddings API limits per request
+MAX_BATCH_INPUTS = 2048
+MAX_BATCH_TOKENS = 300_000
+
+EMBED_CONCURRENCY = int(os.getenv("OPENAI_EMBED_CONCURRENCY", "16"))
+MAX_RETRIES = 5
+
+# Shared with the API server so both embed queries and chunks with the same model
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+# Keep-alive HTTP/2 connection pools so requests reuse TLS connections
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+_shared_http: Optional[httpx.Client] = None
+
+def _get_shared_http() -> httpx.Client:
+    """Create the process-wide sync connection pool on first use."""
+    global _shared_http
+    if _shared_http is None:
+        _shared_http = httpx.Client(http2=True, limits=_HTTP_LIMITS)
+        atexit.register(_shared_http.close)
+    return _shared_http
+
+# Storage dtypes for saved vectors; int8 also stores a per-vector scale
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
 class EmbeddingService:
-    def __init__(self, model="text-embedding-ada-002"):
+    def __init__(self, model=EMBEDDING_MODEL, cache_path: Optional[str] = "data/embeddings/cache.db",
+                 vector_dtype: str = "float16"):
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"vector_dtype must be one of {VECTOR_DTYPES}, got {vector_dtype!r}")
+        
         self.model = model
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.vector_dtype = vector_dtype
+        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_get_shared_http())
+        self.encoding = _get_encoding(model)
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
         
     def generate_embedding(self, text: str) -> List[float]:
         """Generate embedding for a single text."""
@@ -25,44 +64,123 @@ class EmbeddingService:
             print(f"Error generating embedding: {e}")
             return []
     
-    def generate_embeddings_batch(self, texts: List[str], batch_size: int = 100) -> List[List[float]]:
-        """Generate embeddings for multiple texts in batches."""
-        embeddings = []
+    def _prepare_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for upcoming texts; runs in a worker thread while earlier batches are in flight."""
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)]
+    
+    async def _iter_batch_ranges(self, texts: List[str], batch_size: int, executor: ThreadPoolExecutor):
+        """Yield (start, end) ranges within the per-request input and token limits as texts are tokenized."""
+        loop = asyncio.get_running_loop()
+        start = 0
+        batch_tokens = 0
         
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
+        for window_start in range(0, len(texts), batch_size):
+            window = texts[window_start:window_start + batch_size]
+            token_counts = await loop.run_in_executor(executor, self._prepare_batch, window)
             
-            try:
-                response = self.client.embeddings.create(
-                    model=self.model,
-                    input=batch
-                )
-                
-                batch_embeddings = [data.embedding for data in response.data]
-                embeddings.extend(batch_embeddings)
-                
-                print(f"Generated embeddings for batch {i//batch_size + 1}/{(len(texts)-1)//batch_size + 1}")
-                
-            except Exception as e:
-                print(f"Error generating embeddings for batch {i//batch_size + 1}: {e}")
-                # Add empty embeddings for failed batch
-                embeddings.extend([[] for _ in batch])
+            for i, tokens in enumerate(token_counts, window_start):
+                if i > start and (i - start >= batch_size or batch_tokens + tokens > MAX_BATCH_TOKENS):
+                    yield start, i
+                    start = i
+                    batch_tokens = 0
+                batch_tokens += tokens
+        
+        if start < len(texts):
+            yield start, len(texts)
+    
+    async def _embed_batch_async(self, client: openai.AsyncOpenAI, batch: List[str], sem: asyncio.Semaphore) -> List[List[float]]:
+        """Embed one batch, retrying with exponential backoff when rate limited."""
+        async with sem:
+            delay = 1.0
+            for attempt in range(MAX_RETRIES):
+                try:
+                    response = await client.embeddings.create(
+                        model=self.model,
+                        input=batch
+                    )
+                    return [data.embedding for data in response.data]
+                except openai.RateLimitError:
+                    if attempt == MAX_RETRIES - 1:
+                        raise
+                    await asyncio.sleep(delay)
+                    delay *= 2
+    
+    async def _embed_all_async(self, texts: List[str], batch_size: int) -> List[List[float]]:
+        """Embed all batches concurrently, bounded by EMBED_CONCURRENCY in-flight requests."""
+        # Failed batches keep their empty placeholder embeddings
+        embeddings: List[List[float]] = [[] for _ in texts]
+        sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+        
+        # An async pool is bound to its event loop, so each run gets one shared by all its batches
+        http_client = httpx.AsyncClient(http2=True, limits=_HTTP_LIMITS)
+        async with openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client) as client:
+            async def run(batch_num: int, start: int, end: int):
+                try:
+                    embeddings[start:end] = await self._embed_batch_async(client, texts[start:end], sem)
+                    print(f"Generated embeddings for batch {batch_num} ({end - start} texts)")
+                except Exception as e:
+                    print(f"Error generating embeddings for batch {batch_num}: {e}")
+            
+            # Dispatch each batch as soon as its range is known so tokenizing the
+            # next texts overlaps with requests already in flight
+            tasks = []
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                async for start, end in self._iter_batch_ranges(texts, batch_size, executor):
+                    tasks.append(asyncio.create_task(run(len(tasks) + 1, start, end)))
+            
+            await asyncio.gather(*tasks)
         
         return embeddings
     
-    def process_chunks_file(self, chunks_file: Path) -> Dict[str, Any]:
-        """Process chunks file and generate embeddings."""
-        with open(chunks_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    def generate_embeddings_batch(self, texts: List[str], batch_size: int = MAX_BATCH_INPUTS) -> List[List[float]]:
+        """Generate embeddings for multiple texts in concurrent batches."""
+        # Embed each distinct text once and fan the vector out to its duplicates
+        unique_texts = list(dict.fromkeys(texts))
+        if len(unique_texts) < len(texts):
+            print(f"Embedding {len(unique_texts)} unique texts out of {len(texts)}")
         
-        chunks = data["chunks"]
-        texts = [chunk["text"] for chunk in chunks]
+        unique_embeddings = dict(zip(unique_texts, self._embed_unique(unique_texts, batch_size)))
+        return [unique_embeddings[text] for text in texts]
+    
+    def _embed_unique(self, texts: List[str], batch_size: int) -> List[List[float]]:
+        """Embed distinct texts, serving cached vectors and querying the API for the rest."""
+        if self.cache is None:
+            return asyncio.run(self._embed_all_async(texts, batch_size))
         
-        print(f"Generating embeddings for {len(texts)} chunks...")
+        # Only texts missing from the on-disk cache hit the API
+        keys = [EmbeddingCache.make_key(self.model, text) for text in texts]
+        cached = self.cache.get_many(keys)
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        
+        if cached:
+            print(f"Found {len(texts) - len(misses)}/{len(texts)} embeddings in cache")
+        
+        new_embeddings = asyncio.run(self._embed_all_async([texts[i] for i in misses], batch_size)) if misses else []
+        self.cache.put_many(self.model, [
+            (keys[i], embedding) for i, embedding in zip(misses, new_embeddings) if embedding
+        ])
+        
+        embeddings = [cached.get(key, []) for key in keys]
+        for i, embedding in zip(misses, new_embeddings):
+            embeddings[i] = embedding
+        
+        return embeddings
+    
+    def embed_many(self, items: List[Tuple[Hashable, int, str]]) -> Dict[Hashable, Dict[int, List[float]]]:
+        """Embed (file_key, chunk_idx, text) items in shared batches and route vectors back by file."""
+        texts = [text for _, _, text in items]
         embeddings = self.generate_embeddings_batch(texts)
         
+        routed: Dict[Hashable, Dict[int, List[float]]] = {}
+        for (file_key, chunk_idx, _), embedding in zip(items, embeddings):
+            routed.setdefault(file_key, {})[chunk_idx] = embedding
+        
+        return routed
+    
+    def _attach_embeddings(self, data: Dict[str, Any], embeddings: List[List[float]]) -> Dict[str, Any]:
+        """Add embeddings and embedding info to chunks data."""
         # Add embeddings to chunks
-        for i, chunk in enumerate(chunks):
+        for i, chunk in enumerate(data["chunks"]):
             chunk["embedding"] = embeddings[i]
             chunk["embedding_model"] = self.model
         
@@ -75,10 +193,102 @@ class EmbeddingService:
         
         return data
     
-    def save_embeddings(self, data: Dict[str, Any], output_file: Path):
-        """Save chunks with embeddings to file."""
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    def embed(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Add embeddings to in-memory chunks."""
+        embeddings = self.generate_embeddings_batch([chunk["text"] for chunk in chunks])
+        return self._attach_embeddings({"chunks": chunks}, embeddings)["chunks"]
+    
+    def embed_chunk_sets(self, chunk_sets: Dict[Hashable, Dict[str, Any]]) -> Dict[Hashable, Dict[str, Any]]:
+        """Embed several in-memory chunks datasets, sharing embedding batches across all of them."""
+        items = []
+        for key, data in chunk_sets.items():
+            items.extend((key, i, chunk["text"]) for i, chunk in enumerate(data["chunks"]))
+        
+        print(f"Generating embeddings for {len(items)} chunks from {len(chunk_sets)} file(s)...")
+        routed = self.embed_many(items)
+        
+        for key, data in chunk_sets.items():
+            set_embeddings = routed.get(key, {})
+            embeddings = [set_embeddings.get(i, []) for i in range(len(data["chunks"]))]
+            self._attach_embeddings(data, embeddings)
+        
+        return chunk_sets
+    
+    def process_chunks_file(self, chunks_file: Path) -> Dict[str, Any]:
+        """Process chunks file and generate embeddings."""
+        return self.process_chunks_files([chunks_file])[chunks_file]
+    
+    def process_chunks_files(self, chunks_files: List[Path],
+                             preloaded: Optional[Dict[Path, Dict[str, Any]]] = None) -> Dict[Path, Dict[str, Any]]:
+        """Process several chunks files, sharing embedding batches; preloaded data is used instead of reading."""
+        preloaded = preloaded or {}
+        all_data = {}
+        for chunks_file in chunks_files:
+            if chunks_file in preloaded:
+                all_data[chunks_file] = preloaded[chunks_file]
+                continue
+            with open(chunks_file, 'rb') as f:
+                all_data[chunks_file] = orjson.loads(f.read())
+        
+        return self.embed_chunk_sets(all_data)
+    
+    def save_embeddings(self, data: Dict[str, Any], output_file: Path) -> Dict[str, Any]:
+        """Save chunk metadata as JSON and the (optionally quantized) vectors as a .npy, returning what was written for indexing."""
+        chunks = data["chunks"]
+        embedded = [chunk["embedding"] for chunk in chunks if chunk.get("embedding")]
+        
+        # Fill a preallocated float32 matrix instead of building nested lists first
+        matrix = np.empty((len(embedded), len(embedded[0]) if embedded else 0), dtype=np.float32)
+        for row, embedding in enumerate(embedded):
+            matrix[row] = embedding
+        del embedded
+        
+        vectors_file = output_file.with_suffix(".npy")
+        vector_info = {"vectors_file": vectors_file.name, "vector_dtype": self.vector_dtype}
+        
+        scales = None
+        if self.vector_dtype == "int8":
+            # Symmetric per-vector quantization: v ≈ q * scale
+            scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+            scales[scales == 0] = 1.0
+            scales = scales.astype(np.float32)
+            matrix = np.round(matrix / scales[:, None]).astype(np.int8)
+            
+            scales_file = output_file.with_name(f"{output_file.stem}_scales.npy")
+            np.save(scales_file, scales)
+            vector_info["scales_file"] = scales_file.name
+        else:
+            matrix = matrix.astype(self.vector_dtype, copy=False)
+        
+        np.save(vectors_file, matrix)
+        
+        # Stream the metadata one chunk at a time to keep peak memory bounded
+        header = {key: value for key, value in data.items() if key != "chunks"}
+        header.update(vector_info)
+        saved_chunks = []
+        row = 0
+        
+        with open(output_file, 'wb') as f:
+            f.write(b'{"chunks":[')
+            for i, chunk in enumerate(chunks):
+                meta = {key: value for key, value in chunk.items() if key != "embedding"}
+                # Failed embeddings have no row in the vectors file
+                if chunk.get("embedding"):
+                    meta["embedding_index"] = row
+                    row += 1
+                else:
+                    meta["embedding_index"] = None
+                saved_chunks.append(meta)
+                
+                if i:
+                    f.write(b",")
+                f.write(orjson.dumps(meta, option=orjson.OPT_SERIALIZE_NUMPY))
+            f.write(b"]")
+            for key, value in header.items():
+                f.write(b"," + orjson.dumps(key) + b":" + orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY))
+            f.write(b"}")
+        
+        return {"chunks": saved_chunks, "vectors": matrix, "scales": scales}
 
 if __name__ == "__main__":
     if not os.getenv("OPENAI_API_KEY"):
@@ -96,20 +306,18 @@ if __name__ == "__main__":
     if not chunks_files:
         print("No chunk files found. Run text_chunker.py first.")
     else:
-        for chunks_file in chunks_files:
-            print(f"Processing {chunks_file.name}...")
+        try:
+            all_data = embedding_service.process_chunks_files(chunks_files)
+        except Exception as e:
+            print(f"✗ Failed to process chunk files: {e}\n")
+            exit(1)
+        
+        for chunks_file, data_with_embeddings in all_data.items():
+            output_file = embeddings_dir / f"{chunks_file.stem}_embeddings.json"
+            embedding_service.save_embeddings(data_with_embeddings, output_file)
             
-            try:
-                data_with_embeddings = embedding_service.process_chunks_file(chunks_file)
-                
-                output_file = embeddings_dir / f"{chunks_file.stem}_embeddings.json"
-                embedding_service.save_embeddings(data_with_embeddings, output_file)
-                
-                info = data_with_embeddings["embedding_info"]
-                print(f"✓ Generated {info['total_embeddings']} embeddings")
-                if info['failed_embeddings'] > 0:
-                    print(f"⚠ {info['failed_embeddings']} embeddings failed")
-                print(f"Saved to {output_file.name}\n")
-                
-            except Exception as e:
-                print(f"✗ Failed to process {chunks_file.name}: {e}\n")
\ No newline at end of file
+            info = data_with_embeddings["embedding_info"]
+            print(f"✓ {chunks_file.name}: generated {info['total_embeddings']} embeddings")
+            if info['failed_embeddings'] > 0:
+                print(f"⚠ {info['failed_embeddings']} embeddings failed")
+            print(f"Saved to {output_file.name}\n")
\ No newline at end of file
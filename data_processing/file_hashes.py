@@ -0,0 +1,32 @@
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+_READ_BUFFER = 1024 * 1024
+
+def sha256_file(path: Path, salt: str = "") -> str:
+    """Hash a file's contents (plus an optional config salt) in 1 MB reads."""
+    digest = hashlib.sha256(salt.encode("utf-8"))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_READ_BUFFER), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def sidecar_for(output_file: Path) -> Path:
+    """Path of the <output>.sha256 file recording the input hash an output was built from."""
+    return output_file.with_name(f"{output_file.name}.sha256")
+
+def read_hash(sidecar: Path) -> Optional[str]:
+    """Read a recorded hash, or None if it has not been written yet."""
+    try:
+        return sidecar.read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+
+def write_hash(sidecar: Path, digest: str):
+    """Record the input hash once its output has been written successfully."""
+    sidecar.write_text(digest, encoding='utf-8')
+
+def is_up_to_date(output_file: Path, digest: str) -> bool:
+    """Check that an output exists and was built from an input with this hash."""
+    return output_file.exists() and read_hash(sidecar_for(output_file)) == digest
@@ -1,35 +1,118 @@
 import pdfplumber
+import pypdfium2
 import os
-import json
+import orjson
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+from data_processing.file_hashes import sha256_file, sidecar_for, write_hash, is_up_to_date
+
+PDF_ENGINES = ("pdfium", "pdfplumber")
+
+def _extract_pages_pdfplumber(pdf_path, page_nums):
+    """Extract text from the given 1-based pages with pdfplumber; runs in a worker process."""
+    text_content = []
+    
+    with pdfplumber.open(pdf_path, pages=page_nums) as pdf:
+        for page_num, page in zip(page_nums, pdf.pages):
+            text = page.extract_text()
+            if text:
+                text_content.append({
+                    "page": page_num,
+                    "text": text.strip()
+                })
+    
+    return text_content
+
+def _extract_pages_pdfium(pdf_path, page_nums):
+    """Extract text from the given 1-based pages with PDFium; runs in a worker process."""
+    text_content = []
+    
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        for page_num in page_nums:
+            page = pdf[page_num - 1]
+            textpage = page.get_textpage()
+            # PDFium separates lines with CRLF
+            text = textpage.get_text_range().replace("\r\n", "\n").strip()
+            textpage.close()
+            page.close()
+            
+            if text:
+                text_content.append({
+                    "page": page_num,
+                    "text": text
+                })
+    finally:
+        pdf.close()
+    
+    return text_content
+
+def _count_pages(pdf_path, engine):
+    """Return the number of pages in a PDF."""
+    if engine == "pdfium":
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
 class PDFExtractor:
-    def __init__(self, raw_data_dir="data/raw", processed_data_dir="data/processed"):
+    def __init__(self, raw_data_dir="data/raw", processed_data_dir="data/processed", max_workers=None,
+                 engine="pdfium"):
+        if engine not in PDF_ENGINES:
+            raise ValueError(f"engine must be one of {PDF_ENGINES}, got {engine!r}")
+        
+        self.engine = engine
         self.raw_data_dir = Path(raw_data_dir)
         self.processed_data_dir = Path(processed_data_dir)
         self.processed_data_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers or os.cpu_count() or 1
     
-    def extract_text_from_pdf(self, pdf_path):
-        """Extract text from a PDF file using pdfplumber."""
-        text_content = []
+    def extract_text_from_pdf(self, pdf_path, max_workers=None):
+        """Extract text from a PDF file with the configured engine, spreading pages across processes."""
+        extract_pages = _extract_pages_pdfium if self.engine == "pdfium" else _extract_pages_pdfplumber
         
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    text = page.extract_text()
-                    if text:
-                        text_content.append({
-                            "page": page_num,
-                            "text": text.strip()
-                        })
-                        
+            total_pages = _count_pages(str(pdf_path), self.engine)
+            
+            page_nums = list(range(1, total_pages + 1))
+            workers = min(max_workers or self.max_workers, total_pages)
+            
+            if workers <= 1:
+                return extract_pages(str(pdf_path), page_nums)
+            
+            # Contiguous page ranges so each worker opens the PDF only once
+            step = -(-total_pages // workers)
+            page_ranges = [page_nums[i:i + step] for i in range(0, total_pages, step)]
+            
+            text_content = []
+            with ProcessPoolExecutor(max_workers=len(page_ranges)) as executor:
+                for pages in executor.map(extract_pages, [str(pdf_path)] * len(page_ranges), page_ranges):
+                    text_content.extend(pages)
+            
             return text_content
         except Exception as e:
             print(f"Error extracting text from {pdf_path}: {e}")
             return []
     
-    def process_all_pdfs(self):
-        """Process all PDF files in the raw data directory."""
+    def extract(self, pdf_path, max_workers=None):
+        """Extract a PDF into the in-memory document dict that is saved as *_extracted.json."""
+        text_content = self.extract_text_from_pdf(pdf_path, max_workers=max_workers)
+        if not text_content:
+            return None
+        
+        return {
+            "source": Path(pdf_path).name,
+            "total_pages": len(text_content),
+            "pages": text_content
+        }
+    
+    def process_all_pdfs(self, force=False):
+        """Process all PDF files in the raw data directory, skipping PDFs unchanged since their last extraction."""
         pdf_files = list(self.raw_data_dir.glob("*.pdf"))
         
         if not pdf_files:
@@ -37,40 +120,86 @@ class PDFExtractor:
             return
         
         results = {}
+        digests = {}
+        pending = []
         
         for pdf_file in pdf_files:
-            print(f"Processing {pdf_file.name}...")
-            text_content = self.extract_text_from_pdf(pdf_file)
+            # The engine is part of the hash so switching engines re-extracts
+            digest = sha256_file(pdf_file, self.engine)
+            output_file, text_file = self._output_paths(pdf_file)
             
-            if text_content:
-                # Save extracted text as JSON
-                output_file = self.processed_data_dir / f"{pdf_file.stem}_extracted.json"
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump({
-                        "source": pdf_file.name,
-                        "total_pages": len(text_content),
-                        "pages": text_content
-                    }, f, indent=2, ensure_ascii=False)
-                
-                # Save as plain text for easier processing
-                text_file = self.processed_data_dir / f"{pdf_file.stem}_text.txt"
-                with open(text_file, 'w', encoding='utf-8') as f:
-                    for page_data in text_content:
-                        f.write(f"--- Page {page_data['page']} ---\n")
-                        f.write(page_data['text'])
-                        f.write("\n\n")
-                
+            if not force and is_up_to_date(output_file, digest):
+                with open(output_file, 'rb') as f:
+                    pages = orjson.loads(f.read())["total_pages"]
                 results[pdf_file.name] = {
-                    "pages": len(text_content),
+                    "pages": pages,
                     "json_file": str(output_file),
-                    "text_file": str(text_file)
+                    "text_file": str(text_file),
+                    "skipped": True
                 }
-                
-                print(f"✓ Extracted {len(text_content)} pages from {pdf_file.name}")
+                print(f"⏭ {pdf_file.name} unchanged, skipping extraction")
             else:
-                print(f"✗ Failed to extract text from {pdf_file.name}")
+                digests[pdf_file.name] = digest
+                pending.append(pdf_file)
+        
+        if not pending:
+            return results
+        
+        pdf_workers = min(len(pending), self.max_workers)
+        # Split the CPU budget between PDFs and the pages within each PDF
+        page_workers = max(1, self.max_workers // pdf_workers)
+        
+        if pdf_workers <= 1:
+            outcomes = [self._process_single_pdf(pdf_file, page_workers) for pdf_file in pending]
+        else:
+            with ProcessPoolExecutor(max_workers=pdf_workers) as executor:
+                futures = [executor.submit(self._process_single_pdf, pdf_file, page_workers) for pdf_file in pending]
+                outcomes = [future.result() for future in as_completed(futures)]
+        
+        for filename, info in outcomes:
+            if info:
+                results[filename] = info
+                write_hash(sidecar_for(Path(info["json_file"])), digests[filename])
         
         return results
+    
+    def _output_paths(self, pdf_file):
+        """Return the extracted JSON and plain-text output paths for a PDF."""
+        return (
+            self.processed_data_dir / f"{pdf_file.stem}_extracted.json",
+            self.processed_data_dir / f"{pdf_file.stem}_text.txt"
+        )
+    
+    def _process_single_pdf(self, pdf_file, page_workers=None):
+        """Extract one PDF and write its JSON and plain-text outputs."""
+        print(f"Processing {pdf_file.name}...")
+        data = self.extract(pdf_file, max_workers=page_workers)
+        
+        if not data:
+            print(f"✗ Failed to extract text from {pdf_file.name}")
+            return pdf_file.name, None
+        
+        output_file, text_file = self._output_paths(pdf_file)
+        
+        # Save extracted text as JSON
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        
+        # Save as plain text for easier processing
+        with open(text_file, 'w', encoding='utf-8') as f:
+            for page_data in data["pages"]:
+                f.write(f"--- Page {page_data['page']} ---\n")
+                f.write(page_data['text'])
+                f.write("\n\n")
+        
+        print(f"✓ Extracted {data['total_pages']} pages from {pdf_file.name}")
+        
+        return pdf_file.name, {
+            "pages": data["total_pages"],
+            "json_file": str(output_file),
+            "text_file": str(text_file),
+            "data": data
+        }
 
 if __name__ == "__main__":
     extractor = PDFExtractor()
@@ -1,120 +1,148 @@
+import os
 import re
-import json
+import orjson
 import tiktoken
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
+
+_WS_RE = re.compile(r'\s+')
+_PAGENUM_RE = re.compile(r'^\d+\s*$', flags=re.MULTILINE)
+_OCR_RE = re.compile(r'[^\w\s\.\,\;\:\!\?\-\'\"]')
+_SENT_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+_QUOTE_TABLE = str.maketrans({
+    '\u201c': '"', '\u201d': '"', '\u201e': '"',
+    '\u2018': "'", '\u2019': "'", '\u201a': "'",
+})
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """Load the tiktoken encoding for a model once per process."""
+    return tiktoken.encoding_for_model(model)
 
 class TextChunker:
     def __init__(self, chunk_size=1000, chunk_overlap=200, model="text-embedding-ada-002"):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.encoding = tiktoken.encoding_for_model(model)
+        self.encoding = _get_encoding(model)
+        self._sent_tok_cache: Dict[str, int] = {}
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text content."""
         # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
+        text = _WS_RE.sub(' ', text)
         
         # Remove page headers/footers patterns
-        text = re.sub(r'^\d+\s*$', '', text, flags=re.MULTILINE)
+        text = _PAGENUM_RE.sub('', text)
         
-        # Remove common OCR artifacts
-        text = re.sub(r'[^\w\s\.\,\;\:\!\?\-\'\"]', ' ', text)
+        # Normalize curly quotes to ASCII before stripping other characters
+        text = text.translate(_QUOTE_TABLE)
         
-        # Normalize quotes
-        text = re.sub(r'["""]', '"', text)
-        text = re.sub(r"[''']", "'", text)
+        # Remove common OCR artifacts
+        text = _OCR_RE.sub(' ', text)
         
         return text.strip()
     
     def split_into_sentences(self, text: str) -> List[str]:
         """Split text into sentences while preserving context."""
         # Simple sentence splitting (can be improved with spacy/nltk)
-        sentences = re.split(r'(?<=[.!?])\s+', text)
+        sentences = _SENT_SPLIT_RE.split(text)
         return [s.strip() for s in sentences if s.strip()]
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text using tiktoken."""
         return len(self.encoding.encode(text))
     
+    def _sentence_tokens(self, sentences: List[str]) -> List[int]:
+        """Count tokens per sentence, encoding uncached sentences in one multi-threaded batch."""
+        uncached = [s for s in dict.fromkeys(sentences) if s not in self._sent_tok_cache]
+        if uncached:
+            # Cleaned text has no special-token markup, so ordinary encoding gives the same counts
+            encoded = self.encoding.encode_ordinary_batch(uncached, num_threads=os.cpu_count() or 1)
+            self._sent_tok_cache.update(zip(uncached, map(len, encoded)))
+        return [self._sent_tok_cache[s] for s in sentences]
+    
     def create_chunks(self, text: str, source_info: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Create overlapping chunks from text."""
         cleaned_text = self.clean_text(text)
         sentences = self.split_into_sentences(cleaned_text)
         
         chunks = []
-        current_chunk = ""
         current_sentences = []
+        sentence_lens = []
+        current_tokens = 0
         
-        for sentence in sentences:
+        for sentence, st in zip(sentences, self._sentence_tokens(sentences)):
             # Check if adding this sentence would exceed chunk size
-            potential_chunk = current_chunk + " " + sentence if current_chunk else sentence
-            
-            if self.count_tokens(potential_chunk) > self.chunk_size and current_chunk:
+            # (the joining space is counted as one extra token)
+            if current_sentences and current_tokens + st + 1 > self.chunk_size:
                 # Save current chunk
-                chunks.append({
-                    "text": current_chunk.strip(),
-                    "token_count": self.count_tokens(current_chunk),
-                    "source": source_info,
-                    "chunk_id": len(chunks)
-                })
+                chunks.append(self._make_chunk(current_sentences, current_tokens, source_info, len(chunks)))
                 
                 # Start new chunk with overlap
-                overlap_text = self._create_overlap(current_sentences)
-                current_chunk = overlap_text + " " + sentence if overlap_text else sentence
-                current_sentences = [sentence]
+                overlap_sentences, overlap_lens, overlap_tokens = self._create_overlap(current_sentences, sentence_lens)
+                current_sentences = overlap_sentences + [sentence]
+                sentence_lens = overlap_lens + [st]
+                current_tokens = overlap_tokens + st + 1 if overlap_sentences else st
             else:
-                current_chunk = potential_chunk
+                current_tokens += st + 1 if current_sentences else st
                 current_sentences.append(sentence)
+                sentence_lens.append(st)
         
         # Add final chunk if it exists
-        if current_chunk.strip():
-            chunks.append({
-                "text": current_chunk.strip(),
-                "token_count": self.count_tokens(current_chunk),
-                "source": source_info,
-                "chunk_id": len(chunks)
-            })
+        if current_sentences:
+            chunks.append(self._make_chunk(current_sentences, current_tokens, source_info, len(chunks)))
         
         return chunks
     
-    def _create_overlap(self, sentences: List[str]) -> str:
-        """Create overlap text from the end of current sentences."""
-        if not sentences:
-            return ""
-        
-        overlap_text = ""
+    def _make_chunk(self, sentences: List[str], token_count: int, source_info: Dict[str, Any], chunk_id: int) -> Dict[str, Any]:
+        """Build a chunk record; sentences are already stripped, so one join gives the final text."""
+        return {
+            "text": " ".join(sentences),
+            "token_count": token_count,
+            "source": source_info,
+            "chunk_id": chunk_id
+        }
+    
+    def _create_overlap(self, sentences: List[str], sentence_lens: List[int]) -> Tuple[List[str], List[int], int]:
+        """Select trailing sentences (with their token counts) that fit in the overlap size."""
+        overlap_sentences = []
+        overlap_lens = []
         overlap_tokens = 0
         
         # Add sentences from the end until we reach overlap size
-        for sentence in reversed(sentences):
-            potential_overlap = sentence + " " + overlap_text if overlap_text else sentence
-            tokens = self.count_tokens(potential_overlap)
+        for sentence, tokens in reversed(list(zip(sentences, sentence_lens))):
+            added = tokens + 1 if overlap_sentences else tokens
             
-            if tokens <= self.chunk_overlap:
-                overlap_text = potential_overlap
-                overlap_tokens = tokens
-            else:
+            if overlap_tokens + added > self.chunk_overlap:
                 break
+            
+            overlap_sentences.append(sentence)
+            overlap_lens.append(tokens)
+            overlap_tokens += added
         
-        return overlap_text.strip()
+        overlap_sentences.reverse()
+        overlap_lens.reverse()
+        return overlap_sentences, overlap_lens, overlap_tokens
     
     def process_extracted_json(self, json_file_path: Path) -> List[Dict[str, Any]]:
         """Process extracted JSON file and create chunks."""
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(json_file_path, 'rb') as f:
+            data = orjson.loads(f.read())
         
+        return self.chunk(data, json_file_path)
+    
+    def chunk(self, data: Dict[str, Any], processed_file: Optional[Path] = None) -> List[Dict[str, Any]]:
+        """Create chunks from an in-memory extracted document."""
         all_chunks = []
         
         # Combine all pages into one text for better chunking
-        full_text = ""
-        for page_data in data["pages"]:
-            full_text += page_data["text"] + "\n\n"
+        full_text = "\n\n".join(page_data["text"] for page_data in data["pages"])
         
         source_info = {
             "filename": data["source"],
             "total_pages": data["total_pages"],
-            "processed_file": str(json_file_path)
+            "processed_file": str(processed_file) if processed_file else None
         }
         
         chunks = self.create_chunks(full_text, source_info)
@@ -122,9 +150,9 @@ class TextChunker:
         
         return all_chunks
     
-    def save_chunks(self, chunks: List[Dict[str, Any]], output_file: Path):
-        """Save chunks to JSON file."""
-        chunk_data = {
+    def to_chunk_data(self, chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Wrap chunks with the chunking config, as saved in *_chunks.json."""
+        return {
             "total_chunks": len(chunks),
             "chunking_config": {
                 "chunk_size": self.chunk_size,
@@ -132,9 +160,11 @@ class TextChunker:
             },
             "chunks": chunks
         }
-        
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(chunk_data, f, indent=2, ensure_ascii=False)
+    
+    def save_chunks(self, chunks: List[Dict[str, Any]], output_file: Path):
+        """Save chunks to JSON file."""
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(self.to_chunk_data(chunks), option=orjson.OPT_INDENT_2))
 
 if __name__ == "__main__":
     chunker = TextChunker()
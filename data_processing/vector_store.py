@@ -1,10 +1,19 @@
 import chromadb
-import json
+import orjson
 import uuid
+import numpy as np
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from chromadb.config import Settings
 
+ADD_BATCH_SIZE = 5000
+
+# In-memory search matrix dtypes; int8 also keeps a per-row scale. float16 and int8
+# only save memory: every search re-inflates their rows, so they're slower than float32
+MATRIX_DTYPES = ("float32", "float16", "int8")
+# Rows re-inflated to float32 per step, bounding the temporary copy
+SEARCH_BLOCK_ROWS = 4096
+
 class VectorStore:
     def __init__(self, persist_directory: str = "data/embeddings/chroma_db"):
         self.persist_directory = Path(persist_directory)
@@ -21,6 +30,9 @@ class VectorStore:
         self.collection_name = "gurdjieff_texts"
         self.collection = None
         self._initialize_collection()
+        
+        # Resident copy of the collection for exact matrix search, filled by load_matrix()
+        self._matrix: Optional[np.ndarray] = None
     
     def _initialize_collection(self):
         """Initialize or get the collection."""
@@ -36,46 +48,67 @@ class VectorStore:
             )
             print(f"Created new collection: {self.collection_name}")
     
-    def add_embeddings_from_file(self, embeddings_file: Path):
-        """Add embeddings from a JSON file to the vector store."""
-        with open(embeddings_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    def add_embeddings_from_file(self, embeddings_file: Path, replace: bool = False):
+        """Add embeddings from a JSON file to the vector store, optionally replacing its sources' chunks."""
+        with open(embeddings_file, 'rb') as f:
+            data = orjson.loads(f.read())
+        
+        vectors = None
+        scales = None
+        if "vectors_file" in data:
+            # Vectors live in a .npy next to the metadata JSON
+            vectors = np.load(embeddings_file.parent / data["vectors_file"], mmap_mode='r')
+            if "scales_file" in data:
+                scales = np.load(embeddings_file.parent / data["scales_file"])
+        
+        self.add_chunks(data["chunks"], embeddings_file.stem, replace=replace,
+                        vectors=vectors, scales=scales, label=embeddings_file.name)
+    
+    def add_chunks(self, chunks: List[Dict[str, Any]], id_prefix: str, replace: bool = False,
+                   vectors: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None,
+                   label: Optional[str] = None):
+        """Add chunks to the vector store from inline embeddings or rows of a saved vectors matrix."""
+        label = label or id_prefix
+        
+        if replace:
+            # Drop previously indexed chunks so removed or renumbered chunks don't linger
+            for source_file in {chunk["source"]["filename"] for chunk in chunks}:
+                self.collection.delete(where={"source_file": source_file})
         
-        chunks = data["chunks"]
-        valid_chunks = [chunk for chunk in chunks if chunk.get("embedding")]
+        if vectors is not None:
+            valid_chunks = [chunk for chunk in chunks if chunk.get("embedding_index") is not None]
+            rows = [chunk["embedding_index"] for chunk in valid_chunks]
+        else:
+            valid_chunks = [chunk for chunk in chunks if chunk.get("embedding")]
+            vectors = np.asarray([chunk["embedding"] for chunk in valid_chunks], dtype=np.float32)
+            rows = list(range(len(valid_chunks)))
         
         if not valid_chunks:
-            print(f"No valid embeddings found in {embeddings_file.name}")
+            print(f"No valid embeddings found in {label}")
             return
         
         # Prepare data for ChromaDB
-        ids = []
-        embeddings = []
-        documents = []
-        metadatas = []
-        
-        for chunk in valid_chunks:
-            chunk_id = f"{embeddings_file.stem}_{chunk['chunk_id']}"
-            ids.append(chunk_id)
-            embeddings.append(chunk["embedding"])
-            documents.append(chunk["text"])
-            
-            metadata = {
-                "source_file": chunk["source"]["filename"],
-                "total_pages": chunk["source"]["total_pages"],
-                "chunk_id": chunk["chunk_id"],
-                "token_count": chunk["token_count"],
-                "embedding_model": chunk["embedding_model"]
-            }
-            metadatas.append(metadata)
+        ids = [f"{id_prefix}_{chunk['chunk_id']}" for chunk in valid_chunks]
+        documents = [chunk["text"] for chunk in valid_chunks]
+        metadatas = [{
+            "source_file": chunk["source"]["filename"],
+            "total_pages": chunk["source"]["total_pages"],
+            "chunk_id": chunk["chunk_id"],
+            "token_count": chunk["token_count"],
+            "embedding_model": chunk["embedding_model"]
+        } for chunk in valid_chunks]
         
-        # Add to collection in batches to avoid size limits
-        batch_size = 100
-        total_added = 0
+        # Add in as few calls as possible, staying under ChromaDB's batch limit
+        batch_size = min(ADD_BATCH_SIZE, getattr(self.client, "max_batch_size", ADD_BATCH_SIZE))
         
         for i in range(0, len(ids), batch_size):
             batch_ids = ids[i:i + batch_size]
-            batch_embeddings = embeddings[i:i + batch_size]
+            batch_rows = rows[i:i + batch_size]
+            # Re-inflate float16/int8 storage to float32 for ChromaDB
+            batch_embeddings = vectors[batch_rows].astype(np.float32)
+            if scales is not None:
+                batch_embeddings *= scales[batch_rows, None]
+            batch_embeddings = batch_embeddings.tolist()
             batch_documents = documents[i:i + batch_size]
             batch_metadatas = metadatas[i:i + batch_size]
             
@@ -85,48 +118,125 @@ class VectorStore:
                 documents=batch_documents,
                 metadatas=batch_metadatas
             )
-            total_added += len(batch_ids)
-            print(f"  Added batch {i//batch_size + 1}/{(len(ids)-1)//batch_size + 1} ({total_added}/{len(ids)})")
         
-        print(f"✓ Added {len(valid_chunks)} chunks from {embeddings_file.name}")
+        print(f"✓ Added {len(valid_chunks)} chunks from {label}")
     
     def similarity_search(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """Search for similar documents using text query."""
         # Note: This requires query embedding to be provided separately
         # For now, we'll use the embedding search method
         raise NotImplementedError("Use similarity_search_by_embedding instead")
+    
+    def load_matrix(self, dtype: str = "float32"):
+        """Load every stored embedding into one resident matrix, optionally quantized to float16 or int8."""
+        if dtype not in MATRIX_DTYPES:
+            raise ValueError(f"dtype must be one of {MATRIX_DTYPES}, got {dtype!r}")
         
-        # Format results
-        formatted_results = []
-        for i in range(len(results["ids"][0])):
-            formatted_results.append({
-                "id": results["ids"][0][i],
-                "text": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i],
-                "distance": results["distances"][0][i]
-            })
-        
-        return formatted_results
+        # A snapshot: chunks added to the collection later aren't searched until this is called again
+        data = self.collection.get(include=["embeddings", "documents", "metadatas"])
+        if not data["ids"]:
+            # Nothing indexed yet; keep searching through ChromaDB
+            self._matrix = None
+            print("Collection is empty; not loading a search matrix")
+            return
+        
+        self._ids = data["ids"]
+        self._documents = data["documents"]
+        self._metadatas = data["metadatas"]
+        matrix = np.asarray(data["embeddings"], dtype=np.float32).reshape(len(self._ids), -1)
+        # Distances must match what ChromaDB would report for this collection
+        self._space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        
+        self._scales = None
+        if dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._scales = scales.astype(np.float32)
+            matrix = np.round(matrix / scales[:, None]).astype(np.int8)
+        elif dtype == "float16":
+            matrix = matrix.astype(np.float16)
+        self._matrix = matrix
+        
+        # Norms of the stored (dequantized) rows keep distances self-consistent
+        self._sq_norms = np.concatenate(
+            [np.einsum("ij,ij->i", block, block) for block in self._iter_blocks()]
+        )
+        
+        print(f"Loaded {len(self._ids)} embeddings into memory for search ({dtype}, {matrix.nbytes / 1e6:.1f} MB)")
     
-    def similarity_search_by_embedding(self, embedding: List[float], n_results: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar documents using embedding vector."""
+    def _iter_blocks(self):
+        """Yield the resident matrix as float32 row blocks, applying int8 scales."""
+        for i in range(0, len(self._matrix), SEARCH_BLOCK_ROWS):
+            block = self._matrix[i:i + SEARCH_BLOCK_ROWS].astype(np.float32)
+            if self._scales is not None:
+                block *= self._scales[i:i + SEARCH_BLOCK_ROWS, None]
+            yield block
+    
+    def similarity_search_by_embedding(self, embedding: List[float], n_results: int = 5,
+                                       max_distance: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Search for similar documents using embedding vector, optionally dropping results at or beyond max_distance."""
+        if self._matrix is not None:
+            return self._matrix_search(embedding, n_results, max_distance)
+        
         results = self.collection.query(
             query_embeddings=[embedding],
             n_results=n_results,
             include=["documents", "metadatas", "distances"]
         )
         
+        ids = results["ids"][0]
+        distances = results["distances"][0]
+        keep = len(ids)
+        if max_distance is not None:
+            # Results come back nearest first, so the ones within max_distance are a prefix
+            keep = int(np.searchsorted(np.asarray(distances), max_distance, side="left"))
+        
         # Format results
-        formatted_results = []
-        for i in range(len(results["ids"][0])):
-            formatted_results.append({
-                "id": results["ids"][0][i],
-                "text": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i],
-                "distance": results["distances"][0][i]
-            })
-        
-        return formatted_results
+        return [
+            {"id": id_, "text": text, "metadata": metadata, "distance": distance}
+            for id_, text, metadata, distance in zip(
+                ids[:keep], results["documents"][0][:keep], results["metadatas"][0][:keep], distances[:keep]
+            )
+        ]
+    
+    def _matrix_search(self, embedding: List[float], n_results: int,
+                       max_distance: Optional[float]) -> List[Dict[str, Any]]:
+        """Brute-force nearest-neighbour search over the resident matrix."""
+        n_results = min(n_results, len(self._ids))
+        if n_results <= 0:
+            # A negative k would make argpartition return nearly every row
+            return []
+        
+        q = np.asarray(embedding, dtype=np.float32)
+        if self._matrix.dtype == np.float32:
+            dots = self._matrix @ q
+        else:
+            # Quantized rows are re-inflated a block at a time so the full float32 copy never exists
+            dots = np.concatenate([block @ q for block in self._iter_blocks()])
+        if self._space == "cosine":
+            # Zero vectors would otherwise give NaN distances that argpartition ranks arbitrarily
+            distances = 1.0 - dots / np.maximum(np.sqrt(self._sq_norms) * np.linalg.norm(q), 1e-12)
+        elif self._space == "ip":
+            distances = 1.0 - dots
+        else:
+            # Squared L2, ChromaDB's default
+            distances = self._sq_norms + q @ q - 2.0 * dots
+        
+        # Partial sort: only the top n_results are ordered
+        top = np.argpartition(distances, n_results - 1)[:n_results]
+        top = top[np.argsort(distances[top])]
+        if max_distance is not None:
+            top = top[:int(np.searchsorted(distances[top], max_distance, side="left"))]
+        
+        return [
+            {
+                "id": self._ids[i],
+                "text": self._documents[i],
+                "metadata": self._metadatas[i],
+                "distance": float(distances[i])
+            }
+            for i in top.tolist()
+        ]
     
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get statistics about the collection."""
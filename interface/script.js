@@ -91,16 +91,36 @@ class GurdjieffBot {
         this.showTypingIndicator();
         
         try {
-            const response = await $.ajax({
-                url: `${this.apiUrl}/chat`,
+            const response = await fetch(`${this.apiUrl}/chat`, {
                 method: 'POST',
-                contentType: 'application/json',
-                data: JSON.stringify({ message: message }),
-                timeout: 30000
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ message: message, stream: true })
+            });
+            if (!response.ok) throw { status: response.status };
+            
+            // Render tokens as they stream in, then swap in the final message with its sources
+            let text = '';
+            let sources = [];
+            let $streaming = null;
+            
+            await this.readEvents(response, (event) => {
+                if (event.error) throw new Error(event.error);
+                if (event.sources) sources = event.sources;
+                if (event.delta) {
+                    if (!$streaming) {
+                        this.hideTypingIndicator();
+                        this.addBotMessage('');
+                        $streaming = this.$chatMessages.find('.bot-message').last();
+                    }
+                    text += event.delta;
+                    $streaming.find('.message-content').html(this.formatMessage(text));
+                    this.scrollToBottom();
+                }
             });
             
             this.hideTypingIndicator();
-            this.addBotMessage(response.response, response.sources);
+            if ($streaming) $streaming.remove();
+            this.addBotMessage(text, sources);
             
         } catch (error) {
             this.hideTypingIndicator();
@@ -108,12 +128,10 @@ class GurdjieffBot {
             
             let errorMessage = '❌ Sorry, I encountered an error. ';
             
-            if (error.status === 0) {
+            if (error instanceof TypeError) {
                 errorMessage += 'Please check if the server is running.';
             } else if (error.status === 500) {
                 errorMessage += 'Server error. Please try again.';
-            } else if (error.statusText === 'timeout') {
-                errorMessage += 'Request timed out. Please try again.';
             } else {
                 errorMessage += 'Please try again.';
             }
@@ -122,6 +140,28 @@ class GurdjieffBot {
         }
     }
     
+    async readEvents(response, onEvent) {
+        // Parse "data: ..." server-sent events from a streamed fetch response
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) return;
+            
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+            
+            for (const frame of frames) {
+                const data = frame.replace(/^data: /, '');
+                if (data === '[DONE]') return;
+                onEvent(JSON.parse(data));
+            }
+        }
+    }
+    
     addUserMessage(message) {
         const messageHtml = `
             <div class="message user-message">
@@ -10,13 +10,11 @@ import argparse
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Add data_processing to path
-sys.path.append(str(Path(__file__).parent / "data_processing"))
-
 from data_processing.pdf_extractor import PDFExtractor
 from data_processing.text_chunker import TextChunker
 from data_processing.embedding_service import EmbeddingService
 from data_processing.vector_store import VectorStore
+from data_processing.file_hashes import sha256_file, sidecar_for, read_hash, write_hash, is_up_to_date
 
 def main():
     parser = argparse.ArgumentParser(description="Process PDFs for Gurdjieff Bot")
@@ -28,6 +26,10 @@ def main():
                        help="Skip embedding generation (use existing embedding files)")
     parser.add_argument("--reset-vector-store", action="store_true",
                        help="Reset the vector store before adding new data")
+    parser.add_argument("--pdf-engine", choices=["pdfium", "pdfplumber"], default="pdfium",
+                       help="PDF text extraction engine (pdfplumber is slower but can help with unusual layouts)")
+    parser.add_argument("--force", action="store_true",
+                       help="Rebuild every stage even when its inputs are unchanged")
     args = parser.parse_args()
     
     # Load environment variables
@@ -50,17 +52,27 @@ def main():
     for dir_path in [raw_dir, processed_dir, embeddings_dir]:
         dir_path.mkdir(parents=True, exist_ok=True)
     
+    # Outputs built in this run are handed to the next stage in memory; files are
+    # still written as snapshots and are only read back for skipped or unchanged stages
+    extracted = {}
+    chunked = {}
+    embedded = {}
+    
     # Step 1: PDF Extraction
     if not args.skip_extraction:
         print("\n📄 Step 1: Extracting text from PDFs...")
-        extractor = PDFExtractor()
-        extraction_results = extractor.process_all_pdfs()
+        extractor = PDFExtractor(engine=args.pdf_engine)
+        extraction_results = extractor.process_all_pdfs(force=args.force)
         
         if not extraction_results:
             print("❌ No PDFs found or extraction failed.")
             print(f"Please add PDF files to {raw_dir}")
             return 1
         
+        for info in extraction_results.values():
+            if "data" in info:
+                extracted[Path(info["json_file"])] = info["data"]
+        
         print(f"✅ Extracted text from {len(extraction_results)} PDF(s)")
     else:
         print("\n⏭️  Step 1: Skipping PDF extraction")
@@ -75,16 +87,29 @@ def main():
             print("❌ No extracted JSON files found. Run without --skip-extraction first.")
             return 1
         
+        # Chunking settings are part of the hash so changing them rebuilds the chunks
+        chunk_salt = f"{chunker.chunk_size}:{chunker.chunk_overlap}"
         chunk_count = 0
         for json_file in json_files:
+            output_file = processed_dir / f"{json_file.stem.replace('_extracted', '_chunks')}.json"
+            digest = sha256_file(json_file, chunk_salt)
+            if not args.force and is_up_to_date(output_file, digest):
+                print(f"  ⏭️  {json_file.name} unchanged, skipping")
+                continue
+            
             print(f"  Processing {json_file.name}...")
-            chunks = chunker.process_extracted_json(json_file)
+            if json_file in extracted:
+                chunks = chunker.chunk(extracted[json_file], json_file)
+            else:
+                chunks = chunker.process_extracted_json(json_file)
             
-            output_file = processed_dir / f"{json_file.stem.replace('_extracted', '_chunks')}.json"
             chunker.save_chunks(chunks, output_file)
+            write_hash(sidecar_for(output_file), digest)
+            chunked[output_file] = chunker.to_chunk_data(chunks)
             chunk_count += len(chunks)
             print(f"  ✅ Created {len(chunks)} chunks")
         
+        extracted.clear()
         print(f"✅ Total chunks created: {chunk_count}")
     else:
         print("\n⏭️  Step 2: Skipping text chunking")
@@ -99,24 +124,40 @@ def main():
             print("❌ No chunk files found. Run without --skip-chunking first.")
             return 1
         
-        total_embeddings = 0
+        embedding_salt = f"{embedding_service.model}:{embedding_service.vector_dtype}"
+        digests = {}
         for chunks_file in chunks_files:
-            print(f"  Processing {chunks_file.name}...")
-            try:
-                data_with_embeddings = embedding_service.process_chunks_file(chunks_file)
-                
-                output_file = embeddings_dir / f"{chunks_file.stem}_embeddings.json"
-                embedding_service.save_embeddings(data_with_embeddings, output_file)
-                
-                info = data_with_embeddings["embedding_info"]
-                total_embeddings += info['total_embeddings']
-                print(f"  ✅ Generated {info['total_embeddings']} embeddings")
-                if info['failed_embeddings'] > 0:
-                    print(f"  ⚠️  {info['failed_embeddings']} embeddings failed")
-                    
-            except Exception as e:
-                print(f"  ❌ Failed to process {chunks_file.name}: {e}")
-                return 1
+            output_file = embeddings_dir / f"{chunks_file.stem}_embeddings.json"
+            digest = sha256_file(chunks_file, embedding_salt)
+            if not args.force and is_up_to_date(output_file, digest):
+                print(f"  ⏭️  {chunks_file.name} unchanged, skipping")
+            else:
+                digests[chunks_file] = digest
+        
+        try:
+            all_data = embedding_service.process_chunks_files(list(digests), preloaded=chunked) if digests else {}
+        except Exception as e:
+            print(f"  ❌ Failed to generate embeddings: {e}")
+            return 1
+        
+        # Drop the in-memory chunks as each file is saved so its float lists are freed;
+        # only the compact saved form is kept for Step 4
+        chunked.clear()
+        total_embeddings = 0
+        for chunks_file in list(all_data):
+            data_with_embeddings = all_data.pop(chunks_file)
+            output_file = embeddings_dir / f"{chunks_file.stem}_embeddings.json"
+            # Index the saved (possibly quantized) vectors so Chroma holds the same values either way
+            embedded[output_file] = embedding_service.save_embeddings(data_with_embeddings, output_file)
+            
+            info = data_with_embeddings["embedding_info"]
+            total_embeddings += info['total_embeddings']
+            print(f"  ✅ {chunks_file.name}: generated {info['total_embeddings']} embeddings")
+            if info['failed_embeddings'] > 0:
+                # Leave the file stale so the next run retries the failed chunks
+                print(f"  ⚠️  {info['failed_embeddings']} embeddings failed")
+            else:
+                write_hash(sidecar_for(output_file), digests[chunks_file])
         
         print(f"✅ Total embeddings generated: {total_embeddings}")
     else:
@@ -136,46 +177,37 @@ def main():
             print("❌ No embedding files found. Run without --skip-embeddings first.")
             return 1
         
-        # Check if collection already has data
-        current_stats = vector_store.get_collection_stats()
-        if current_stats["total_documents"] > 0 and not args.reset_vector_store:
-            print(f"  Vector store already contains {current_stats['total_documents']} documents")
-            print("  Use --reset-vector-store to replace them")
-            print("  Skipping vector store update")
-            
-            # Show final stats
-            final_stats = vector_store.get_collection_stats()
-            print(f"✅ Vector store ready with {final_stats['total_documents']} documents")
-            
-            print("\n🧪 Testing the system...")
-            print("✅ Vector store is ready for queries")
-            print("   Note: Server will handle query embedding generation automatically")
-            
-            print("\n🎉 Pipeline completed successfully!")
-            print("\nNext steps:")
-            print("1. Start the server: uvicorn server.main:app --reload")
-            print("2. Open interface/index.html in your browser")
-            print("3. Start exploring Gurdjieff's teachings!")
-            
-            return 0
+        # An empty (new or reset) collection needs every file; otherwise only changed files are replaced
+        collection_empty = vector_store.get_collection_stats()["total_documents"] == 0
+        rebuild_all = args.force or collection_empty
         
         total_added = 0
         for embedding_file in embedding_files:
+            indexed_sidecar = vector_store.persist_directory / f"{embedding_file.name}.sha256"
+            digest = sha256_file(embedding_file)
+            if not rebuild_all and read_hash(indexed_sidecar) == digest:
+                continue
+            
             print(f"  Adding {embedding_file.name} to vector store...")
-            vector_store.add_embeddings_from_file(embedding_file)
+            # Release each file's vectors once indexed rather than holding the corpus to the end
+            saved = embedded.pop(embedding_file, None)
+            if saved is not None:
+                vector_store.add_chunks(saved["chunks"], embedding_file.stem, replace=not collection_empty,
+                                        vectors=saved["vectors"], scales=saved["scales"], label=embedding_file.name)
+            else:
+                vector_store.add_embeddings_from_file(embedding_file, replace=not collection_empty)
+            write_hash(indexed_sidecar, digest)
             total_added += 1
         
+        if total_added == 0:
+            print("  All embedding files already indexed")
+        
         final_stats = vector_store.get_collection_stats()
         print(f"✅ Vector store ready with {final_stats['total_documents']} documents")
         
-        # Test the system
         print("\n🧪 Testing the system...")
-        test_results = vector_store.similarity_search("consciousness", n_results=3)
-        if test_results:
-            print(f"✅ Search test successful - found {len(test_results)} relevant results")
-            print(f"  Top result similarity: {1 - test_results[0]['distance']:.3f}")
-        else:
-            print("⚠️  Search test returned no results")
+        print("✅ Vector store is ready for queries")
+        print("   Note: Server will handle query embedding generation automatically")
         
     except Exception as e:
         print(f"❌ Vector store error: {e}")
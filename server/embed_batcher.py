@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import openai
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("gurdjieff")
+
+MAX_WAIT_MS = 10
+MAX_BATCH = 64
+# Bound concurrent embedding requests so a burst of batches can't exhaust the connection pool
+MAX_CONCURRENT_BATCHES = 16
+
+_queue: Optional["asyncio.Queue[Tuple[str, asyncio.Future]]"] = None
+_task: Optional[asyncio.Task] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_in_flight = set()
+
+def start(client: openai.AsyncOpenAI, model: str):
+    """Start the background task that coalesces queued texts into batched embedding calls."""
+    global _queue, _task, _semaphore
+    _queue = asyncio.Queue()
+    _semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    _task = asyncio.create_task(_run(client, model))
+
+async def stop():
+    """Cancel the background batching task and wait for batches already sent."""
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    # Let dispatched batches finish before the caller closes the shared HTTP client
+    if _in_flight:
+        await asyncio.gather(*_in_flight, return_exceptions=True)
+
+async def embed(text: str) -> List[float]:
+    """Queue a text for the next batch and wait for its embedding ([] on failure)."""
+    if _queue is None:
+        raise RuntimeError("embed_batcher.start() must be called before embed()")
+    future = asyncio.get_running_loop().create_future()
+    await _queue.put((text, future))
+    return await future
+
+def _drain(batch: List[Tuple[str, asyncio.Future]]):
+    """Move already-queued requests into the batch, up to MAX_BATCH."""
+    while len(batch) < MAX_BATCH and not _queue.empty():
+        batch.append(_queue.get_nowait())
+
+async def _run(client: openai.AsyncOpenAI, model: str):
+    """Collect queued requests into batches and dispatch them."""
+    while True:
+        batch = [await _queue.get()]
+        _drain(batch)
+        
+        # Give concurrent requests a short window to join a partial batch
+        if len(batch) < MAX_BATCH:
+            await asyncio.sleep(MAX_WAIT_MS / 1000)
+            _drain(batch)
+        
+        # Send the batch without holding up collection of the next one
+        task = asyncio.create_task(_flush(client, model, batch))
+        _in_flight.add(task)
+        task.add_done_callback(_in_flight.discard)
+
+async def _embed_texts(client: openai.AsyncOpenAI, model: str, texts: List[str]) -> Dict[str, List[float]]:
+    """Embed texts in one API call, mapping each text to its vector."""
+    async with _semaphore:
+        response = await client.embeddings.create(model=model, input=texts)
+    return dict(zip(texts, (item.embedding for item in response.data)))
+
+async def _embed_one(client: openai.AsyncOpenAI, model: str, text: str) -> Dict[str, List[float]]:
+    """Embed a single text, returning no vector if the API rejects it."""
+    try:
+        return await _embed_texts(client, model, [text])
+    except Exception:
+        logger.exception("Error generating embedding for a %d-character query", len(text))
+        return {}
+
+async def _flush(client: openai.AsyncOpenAI, model: str, batch: List[Tuple[str, asyncio.Future]]):
+    """Embed a batch in one API call and resolve each waiting request's future."""
+    texts = list(dict.fromkeys(text for text, _ in batch))
+    try:
+        embeddings = await _embed_texts(client, model, texts)
+    except Exception:
+        if len(texts) == 1:
+            logger.exception("Error generating embedding for a %d-character query", len(texts[0]))
+            embeddings = {}
+        else:
+            # One bad input fails the whole call; retry each text so only that request fails
+            logger.warning("Embedding batch of %d failed; retrying texts individually", len(texts), exc_info=True)
+            embeddings = {}
+            for result in await asyncio.gather(*(_embed_one(client, model, text) for text in texts)):
+                embeddings.update(result)
+    
+    for text, future in batch:
+        # Skip requests that were cancelled while waiting
+        if not future.done():
+            future.set_result(embeddings.get(text, []))
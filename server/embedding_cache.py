@@ -0,0 +1,55 @@
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Awaitable, Callable, List
+
+EXACT_CAPACITY = 1024
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+
+def _normalize(query: str) -> str:
+    """Lowercase a query and drop punctuation and extra whitespace so trivial variants share a key."""
+    return _WS_RE.sub(' ', _PUNCT_RE.sub(' ', query.lower())).strip()
+
+class EmbeddingCache:
+    def __init__(self, compute: Callable[[str], Awaitable[List[float]]],
+                 exact_capacity: int = EXACT_CAPACITY):
+        self.compute = compute
+        self.exact_capacity = exact_capacity
+        
+        # Only exact (normalized) repeats are reused; near-duplicate questions are
+        # matched on their real embeddings by the search result cache downstream
+        self.exact: "OrderedDict[str, List[float]]" = OrderedDict()
+        
+        self.hits = 0
+        self.misses = 0
+    
+    async def get_or_compute(self, query: str) -> List[float]:
+        """Return the embedding for a query, reusing it when the same normalized query was seen before."""
+        key = hashlib.sha256(_normalize(query).encode("utf-8")).hexdigest()
+        
+        embedding = self.exact.get(key)
+        if embedding is not None:
+            self.exact.move_to_end(key)
+            self.hits += 1
+            return embedding
+        
+        self.misses += 1
+        embedding = await self.compute(query)
+        if not embedding:
+            # Don't cache failures
+            return embedding
+        
+        self.exact[key] = embedding
+        if len(self.exact) > self.exact_capacity:
+            self.exact.popitem(last=False)
+        return embedding
+    
+    def stats(self) -> dict:
+        """Hit/miss counters for the query embedding cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.exact)
+        }
@@ -1,22 +1,53 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
+import anyio.to_thread
+import asyncio
+import hashlib
+import httpx
+import logging
 import openai
+import orjson
 import os
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from typing import List, Dict, Any, Optional
-import sys
-from pathlib import Path
 
-# Add parent directory to path for imports
-sys.path.append(str(Path(__file__).parent.parent))
 from data_processing.vector_store import VectorStore
-from data_processing.embedding_service import EmbeddingService
+from data_processing.embedding_service import EMBEDDING_MODEL
+from server.embedding_cache import EmbeddingCache
+from server import embed_batcher
+from server.result_cache import QVCache
 
 load_dotenv()
 
-app = FastAPI(title="Gurdjieff Bot API", version="1.0.0")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_KEY_PRESENT = bool(OPENAI_API_KEY)
+# float16 halves and int8 quarters the matrix's memory, but each search re-inflates it
+# to float32 and runs several times slower; "off" searches through ChromaDB instead
+SEARCH_MATRIX_DTYPE = os.getenv("SEARCH_MATRIX_DTYPE", "float32")
+SEARCH_MATRIX_ENABLED = SEARCH_MATRIX_DTYPE != "off"
+# Every worker loads its own copy of the matrix, so only one runs by default when it's on
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1" if SEARCH_MATRIX_ENABLED else "4"))
+
+logger = logging.getLogger("gurdjieff")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Built once; the real cause is logged and clients only see a fixed message. Handlers
+# re-raise them with a cleared traceback so frames don't pile up on the shared instances
+EMBEDDING_ERROR = HTTPException(status_code=500, detail="Failed to generate query embedding")
+STATS_ERROR = HTTPException(status_code=500, detail="Error getting stats")
+SEARCH_ERROR = HTTPException(status_code=500, detail="Search error")
+CHAT_ERROR = HTTPException(status_code=500, detail="Chat error")
+
+app = FastAPI(title="Gurdjieff Bot API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -27,26 +58,104 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-vector_store = VectorStore()
-embedding_service = EmbeddingService()
-openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Services are created on startup so importing the app (and forking workers) stays cheap
+vector_store: Optional[VectorStore] = None
+query_embeddings = EmbeddingCache(embed_batcher.embed)
+search_results_cache = QVCache()
+chat_responses: TTLCache = TTLCache(maxsize=2048, ttl=3600)
+
+# Created on startup so the pooled connections belong to the server's event loop
+http_client: Optional[httpx.AsyncClient] = None
+openai_client: Optional[openai.AsyncOpenAI] = None
+
+@app.on_event("startup")
+async def startup():
+    """Initialize services, open the pooled OpenAI client and warm both up."""
+    global vector_store, http_client, openai_client
+    # Blocking store calls share FastAPI's thread pool; widen it from the default 40
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 128
+    
+    vector_store = await anyio.to_thread.run_sync(VectorStore)
+    
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60),
+        timeout=httpx.Timeout(60.0, connect=10.0)
+    )
+    openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+    embed_batcher.start(openai_client, EMBEDDING_MODEL)
+    
+    # Load (or at least open) the collection and an API connection before the first
+    # request arrives; the two are independent, so warm them concurrently
+    warmups = [embed_batcher.embed("warmup")]
+    if SEARCH_MATRIX_ENABLED:
+        warmups.append(anyio.to_thread.run_sync(vector_store.load_matrix, SEARCH_MATRIX_DTYPE))
+    else:
+        warmups.append(anyio.to_thread.run_sync(vector_store.get_collection_stats))
+    await asyncio.gather(*warmups)
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the embedding batcher and close pooled connections."""
+    await embed_batcher.stop()
+    # Startup may have failed before the client was created
+    if http_client is not None:
+        await http_client.aclose()
+
+SYSTEM_PROMPT_PREFIX = """You are a knowledgeable assistant specializing in the teachings and works of George Ivanovich Gurdjieff. 
+
+You have access to relevant excerpts from Gurdjieff's texts and teachings. Use this context to provide thoughtful, accurate responses that reflect his philosophy and methods.
+
+Key principles to remember:
+- Gurdjieff emphasized the importance of conscious effort and voluntary suffering
+- He taught about the three centers of human functioning: thinking, feeling, and moving
+- His work focused on self-observation, self-remembering, and awakening from mechanical behavior
+- Be precise and avoid speculation beyond what the texts support
+- If the context doesn't contain relevant information, say so clearly
+
+Context from Gurdjieff's teachings:
+"""
+
+SYSTEM_PROMPT_SUFFIX = """
+
+Answer based on this context and your knowledge of Gurdjieff's work."""
+
+# Plain, frozen models keep pydantic-core on its fast validation path
+_MODEL_CONFIG = ConfigDict(extra='ignore', frozen=True, str_strip_whitespace=False)
+
+# The embeddings API rejects empty input and anything over 8191 tokens; this keeps
+# ordinary text well under that, and the batcher isolates anything that still fails
+MAX_QUERY_CHARS = 8000
+# Bounds for the remaining client-supplied knobs, so bad values get a 422 instead of
+# dumping the corpus or surfacing as an opaque OpenAI error
+MAX_SEARCH_RESULTS = 50
+MAX_COMPLETION_TOKENS = 4096
 
 class ChatRequest(BaseModel):
-    message: str
-    max_tokens: Optional[int] = 1000
-    temperature: Optional[float] = 0.7
+    model_config = _MODEL_CONFIG
+    
+    message: str = Field(min_length=1, max_length=MAX_QUERY_CHARS)
+    max_tokens: int = Field(default=1000, ge=1, le=MAX_COMPLETION_TOKENS)
+    temperature: float = Field(default=0.7, ge=0.0, le=2.0)
+    stream: bool = False
 
 class ChatResponse(BaseModel):
+    model_config = _MODEL_CONFIG
+    
     response: str
     sources: List[Dict[str, Any]]
     token_usage: Optional[Dict[str, int]] = None
+    cached: bool = False
 
 class SearchRequest(BaseModel):
-    query: str
-    n_results: Optional[int] = 5
+    model_config = _MODEL_CONFIG
+    
+    query: str = Field(min_length=1, max_length=MAX_QUERY_CHARS)
+    n_results: int = Field(default=5, ge=1, le=MAX_SEARCH_RESULTS)
 
 class SearchResponse(BaseModel):
+    model_config = _MODEL_CONFIG
+    
     results: List[Dict[str, Any]]
 
 @app.get("/")
@@ -58,121 +167,192 @@ async def root():
 async def get_stats():
     """Get vector store statistics."""
     try:
-        stats = vector_store.get_collection_stats()
-        return stats
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
+        return await anyio.to_thread.run_sync(vector_store.get_collection_stats)
+    except Exception:
+        logger.exception("Error getting stats")
+        raise STATS_ERROR.with_traceback(None) from None
 
-@app.post("/search", response_model=SearchResponse)
+@app.get("/cache_stats")
+async def get_cache_stats():
+    """Get hit/miss counters for the query embedding and search result caches."""
+    return {
+        "query_embeddings": query_embeddings.stats(),
+        "search_results": search_results_cache.stats()
+    }
+
+async def _search(embedding: List[float], n_results: int, max_distance: Optional[float]) -> List[Dict[str, Any]]:
+    """Run a blocking vector store query on the worker thread pool."""
+    return await anyio.to_thread.run_sync(
+        vector_store.similarity_search_by_embedding, embedding, n_results, max_distance
+    )
+
+@app.post("/search", responses={200: {"model": SearchResponse}})
 async def search_documents(request: SearchRequest):
     """Search for relevant documents."""
     try:
         # Generate embedding for the query
-        query_embedding = embedding_service.generate_embedding(request.query)
+        query_embedding = await query_embeddings.get_or_compute(request.query)
         if not query_embedding:
-            raise HTTPException(status_code=500, detail="Failed to generate query embedding")
+            raise EMBEDDING_ERROR.with_traceback(None)
         
-        results = vector_store.similarity_search_by_embedding(
-            embedding=query_embedding,
-            n_results=request.n_results
-        )
-        return SearchResponse(results=results)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+        results = await search_results_cache.get_or_search(query_embedding, request.n_results, _search)
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Search error")
+        raise SEARCH_ERROR.with_traceback(None) from None
 
-@app.post("/chat", response_model=ChatResponse)
+@app.post("/chat", responses={200: {"model": ChatResponse}})
 async def chat_with_gurdjieff(request: ChatRequest):
     """Chat with the Gurdjieff bot using RAG."""
     try:
         # Generate embedding for the query
-        query_embedding = embedding_service.generate_embedding(request.message)
+        query_embedding = await query_embeddings.get_or_compute(request.message)
         if not query_embedding:
-            raise HTTPException(status_code=500, detail="Failed to generate query embedding")
+            raise EMBEDDING_ERROR.with_traceback(None)
         
-        # Search for relevant context
-        search_results = vector_store.similarity_search_by_embedding(
-            embedding=query_embedding,
-            n_results=5
-        )
-        
-        # Prepare context from search results
-        context_texts = []
-        sources = []
+        # Search for context within the similarity threshold; the top 3 become the context.
+        # A result cache hit applies the cutoff to, and reports, its cached query's distances
+        search_results = await search_results_cache.get_or_search(query_embedding, 5, _search, max_distance=0.8)
+        context = "\n\n".join(result["text"] for result in search_results[:3])
+        sources = [
+            {
+                "source": result["metadata"]["source_file"],
+                "chunk_id": result["metadata"]["chunk_id"],
+                "distance": result["distance"],
+                "preview": result["text"][:200] + "..."
+            }
+            for result in search_results
+        ]
         
-        for result in search_results:
-            if result["distance"] < 0.8:  # Filter by similarity threshold
-                context_texts.append(result["text"])
-                sources.append({
-                    "source": result["metadata"]["source_file"],
-                    "chunk_id": result["metadata"]["chunk_id"],
-                    "distance": result["distance"],
-                    "preview": result["text"][:200] + "..."
-                })
+        # Identical questions over the same retrieved chunks reuse the earlier answer
+        cache_key = _response_cache_key(request, search_results)
+        cached = chat_responses.get(cache_key)
+        if cached is not None:
+            if request.stream:
+                return StreamingResponse(_cached_chat_events(cached), media_type="text/event-stream")
+            return {**cached, "cached": True}
         
         # Build the prompt
-        context = "\n\n".join(context_texts[:3])  # Use top 3 most relevant
-        
-        system_prompt = """You are a knowledgeable assistant specializing in the teachings and works of George Ivanovich Gurdjieff. 
-
-You have access to relevant excerpts from Gurdjieff's texts and teachings. Use this context to provide thoughtful, accurate responses that reflect his philosophy and methods.
-
-Key principles to remember:
-- Gurdjieff emphasized the importance of conscious effort and voluntary suffering
-- He taught about the three centers of human functioning: thinking, feeling, and moving
-- His work focused on self-observation, self-remembering, and awakening from mechanical behavior
-- Be precise and avoid speculation beyond what the texts support
-- If the context doesn't contain relevant information, say so clearly
-
-Context from Gurdjieff's teachings:
-{context}
-
-Answer based on this context and your knowledge of Gurdjieff's work."""
+        system_content = f"{SYSTEM_PROMPT_PREFIX}{context}{SYSTEM_PROMPT_SUFFIX}"
 
         messages = [
-            {"role": "system", "content": system_prompt.format(context=context)},
+            {"role": "system", "content": system_content},
             {"role": "user", "content": request.message}
         ]
         
+        if request.stream:
+            stream = await openai_client.chat.completions.create(
+                model="gpt-4",
+                messages=messages,
+                max_tokens=request.max_tokens,
+                temperature=request.temperature,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            return StreamingResponse(_chat_events(stream, sources, cache_key), media_type="text/event-stream")
+        
         # Get response from OpenAI
-        response = openai_client.chat.completions.create(
+        response = await openai_client.chat.completions.create(
             model="gpt-4",
             messages=messages,
             max_tokens=request.max_tokens,
             temperature=request.temperature
         )
         
-        return ChatResponse(
-            response=response.choices[0].message.content,
-            sources=sources,
-            token_usage={
+        result = {
+            "response": response.choices[0].message.content,
+            "sources": sources,
+            "token_usage": {
                 "prompt_tokens": response.usage.prompt_tokens,
                 "completion_tokens": response.usage.completion_tokens,
                 "total_tokens": response.usage.total_tokens
             }
-        )
+        }
+        chat_responses[cache_key] = result
+        return {**result, "cached": False}
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception:
+        logger.exception("Chat error")
+        raise CHAT_ERROR.with_traceback(None) from None
+
+def _sse(payload: Dict[str, Any]) -> bytes:
+    """Frame a JSON payload as one server-sent event."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def _response_cache_key(request: ChatRequest, search_results: List[Dict[str, Any]]) -> str:
+    """Key a chat answer by the normalized question, sampling settings and retrieved chunk ids."""
+    ids = ",".join(result["id"] for result in search_results)
+    raw = f"{request.message.strip().lower()}|{request.max_tokens}|{request.temperature}|{ids}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+async def _chat_events(stream, sources: List[Dict[str, Any]], cache_key: str):
+    """Emit the sources, then each completion delta, then token usage as server-sent events."""
+    yield _sse({"sources": sources, "cached": False})
+    deltas = []
+    token_usage = None
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                deltas.append(chunk.choices[0].delta.content)
+                yield _sse({"delta": chunk.choices[0].delta.content})
+            if chunk.usage:
+                token_usage = {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "total_tokens": chunk.usage.total_tokens
+                }
+                yield _sse({"token_usage": token_usage})
+    except Exception:
+        # Headers are already sent, so report the failure in-band
+        logger.exception("Error streaming chat response")
+        yield _sse({"error": "Chat stream interrupted"})
+    else:
+        # Only complete answers are cached
+        chat_responses[cache_key] = {"response": "".join(deltas), "sources": sources, "token_usage": token_usage}
+    yield b"data: [DONE]\n\n"
+
+async def _cached_chat_events(cached: Dict[str, Any]):
+    """Replay a cached answer in the same event format as a live stream."""
+    yield _sse({"sources": cached["sources"], "cached": True})
+    yield _sse({"delta": cached["response"]})
+    if cached["token_usage"]:
+        yield _sse({"token_usage": cached["token_usage"]})
+    yield b"data: [DONE]\n\n"
 
 @app.get("/health")
 async def health_check():
     """Detailed health check."""
     health_status = {
         "api": "healthy",
-        "openai_key": "configured" if os.getenv("OPENAI_API_KEY") else "missing",
+        "openai_key": "configured" if OPENAI_KEY_PRESENT else "missing",
         "vector_store": "unknown",
         "document_count": 0
     }
     
     try:
-        stats = vector_store.get_collection_stats()
+        stats = await anyio.to_thread.run_sync(vector_store.get_collection_stats)
         health_status["vector_store"] = "healthy"
         health_status["document_count"] = stats["total_documents"]
-    except Exception as e:
-        health_status["vector_store"] = f"error: {str(e)}"
+    except Exception:
+        logger.exception("Vector store health check failed")
+        health_status["vector_store"] = "error"
     
     return health_status
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    # Workers need an import string; uvloop and httptools ship with uvicorn[standard]
+    uvicorn.run(
+        "server.main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        workers=WEB_CONCURRENCY,
+        log_level="warning",
+        access_log=False
+    )
\ No newline at end of file
@@ -0,0 +1,79 @@
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+CAPACITY = 512
+SIMILARITY_THRESHOLD = 0.95
+
+class QVCache:
+    def __init__(self, capacity: int = CAPACITY, threshold: float = SIMILARITY_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        
+        # entry id -> (unit query embedding, results, n_results, max_distance requested)
+        self.entries: "OrderedDict[int, tuple[np.ndarray, List[Dict[str, Any]], int, float]]" = OrderedDict()
+        self._next_id = 0
+        self._mat: Optional[np.ndarray] = None
+        self._mat_ids: List[int] = []
+        self._mat_n: Optional[np.ndarray] = None
+        self._mat_d: Optional[np.ndarray] = None
+        
+        self.hits = 0
+        self.misses = 0
+    
+    async def get_or_search(self, embedding: List[float], n_results: int,
+                            search: Callable[[List[float], int, Optional[float]], Awaitable[List[Dict[str, Any]]]],
+                            max_distance: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Reuse a similar cached query's results (with its, so approximate, distances), or run the search."""
+        q = np.asarray(embedding, dtype=np.float32)
+        q /= np.linalg.norm(q)
+        limit = np.inf if max_distance is None else max_distance
+        
+        entry_id = self._lookup(q, n_results, limit)
+        if entry_id is not None:
+            self.entries.move_to_end(entry_id)
+            self.hits += 1
+            # Cached results are nearest first, so a tighter limit just trims the tail
+            # (by the cached query's distances, which approximate this query's)
+            return [r for r in self.entries[entry_id][1][:n_results] if r["distance"] < limit]
+        
+        self.misses += 1
+        results = await search(embedding, n_results, max_distance)
+        self._insert(q, results, n_results, limit)
+        return results
+    
+    def _lookup(self, q: np.ndarray, n_results: int, limit: float) -> Optional[int]:
+        """Find the most similar cached query that fetched at least n_results within at least this limit."""
+        if not self.entries:
+            return None
+        
+        # Restack the cached embeddings only after an insert or eviction
+        if self._mat is None:
+            self._mat_ids = list(self.entries)
+            self._mat = np.stack([self.entries[i][0] for i in self._mat_ids])
+            self._mat_n = np.array([self.entries[i][2] for i in self._mat_ids])
+            self._mat_d = np.array([self.entries[i][3] for i in self._mat_ids])
+        
+        sims = self._mat @ q
+        sims[(self._mat_n < n_results) | (self._mat_d < limit)] = -np.inf
+        
+        best = int(np.argmax(sims))
+        if sims[best] >= self.threshold:
+            return self._mat_ids[best]
+        return None
+    
+    def _insert(self, q: np.ndarray, results: List[Dict[str, Any]], n_results: int, limit: float):
+        """Add a query's results, evicting the least recently used entry when full."""
+        self.entries[self._next_id] = (q, results, n_results, limit)
+        self._next_id += 1
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        self._mat = None
+    
+    def stats(self) -> dict:
+        """Hit/miss counters for the result cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries)
+        }
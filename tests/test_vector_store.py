@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from data_processing.vector_store import VectorStore
+
+
+def test_load_matrix_on_empty_store_falls_back_to_chroma(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path / "chroma_db"))
+
+    store.load_matrix("float16")
+
+    assert store._matrix is None
+    assert store.get_collection_stats()["total_documents"] == 0
+
+
+def test_load_matrix_matches_chroma_search(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path / "chroma_db"))
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    store.collection.add(
+        ids=[f"id{i}" for i in range(50)],
+        embeddings=vectors.tolist(),
+        documents=[f"doc {i}" for i in range(50)],
+        metadatas=[{"chunk_id": i} for i in range(50)]
+    )
+    query = vectors[3].tolist()
+
+    expected = store.similarity_search_by_embedding(query, n_results=5)
+    store.load_matrix()
+    results = store.similarity_search_by_embedding(query, n_results=5)
+
+    assert [r["id"] for r in results] == [r["id"] for r in expected]
+    assert np.allclose([r["distance"] for r in results], [r["distance"] for r in expected], atol=1e-4)
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantized_matrix_approximates_chroma_search(tmp_path, dtype):
+    store = VectorStore(persist_directory=str(tmp_path / "chroma_db"))
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8)).astype(np.float32)
+    store.collection.add(
+        ids=[f"id{i}" for i in range(50)],
+        embeddings=vectors.tolist(),
+        documents=[f"doc {i}" for i in range(50)],
+        metadatas=[{"chunk_id": i} for i in range(50)]
+    )
+    query = vectors[3].tolist()
+
+    expected = store.similarity_search_by_embedding(query, n_results=5)
+    store.load_matrix(dtype)
+    results = store.similarity_search_by_embedding(query, n_results=5)
+
+    assert store._matrix.dtype == np.dtype(dtype)
+    assert [r["id"] for r in results] == [r["id"] for r in expected]
+    assert np.allclose([r["distance"] for r in results], [r["distance"] for r in expected], atol=0.1)
+
+
+def test_matrix_search_returns_nothing_for_non_positive_n_results(tmp_path):
+    store = VectorStore(persist_directory=str(tmp_path / "chroma_db"))
+    vectors = np.random.default_rng(0).normal(size=(10, 8)).astype(np.float32)
+    store.collection.add(
+        ids=[f"id{i}" for i in range(10)],
+        embeddings=vectors.tolist(),
+        documents=[f"doc {i}" for i in range(10)],
+        metadatas=[{"chunk_id": i} for i in range(10)]
+    )
+    store.load_matrix()
+
+    assert store.similarity_search_by_embedding(vectors[0].tolist(), n_results=0) == []
+    assert store.similarity_search_by_embedding(vectors[0].tolist(), n_results=-1) == []